@@ -0,0 +1,46 @@
+# cython: language_level=3
+"""Compiled drop-in for :func:`crtshadow.extract`.
+
+Build in place with ``cythonize -i _extract.pyx``; crtshadow falls back to
+its pure-Python version when the extension is not available.
+"""
+
+
+def extract(entries, str suffix_filter=None, set seen=None):
+    """Normalise every hostname straight into the result set.
+
+    With *suffix_filter* set, only that domain and its sub-domains are kept.
+    *seen* collects hashes of the ``name_value`` strings already expanded
+    (a fixed-size key, not the string); pass the same set across calls to
+    skip them in later batches too.
+    """
+    cdef set out = set()
+    cdef dict cert
+    cdef str cn, nv, part
+    cdef Py_hash_t key
+    cdef str suffix = "." + suffix_filter if suffix_filter else ""
+
+    if seen is None:
+        seen = set()
+
+    for cert in entries:
+        cn = (cert.get("common_name") or "").strip().lower()
+        if cn:
+            if cn.startswith("*."):
+                cn = cn[2:]
+            if not suffix or cn.endswith(suffix) or cn == suffix_filter:
+                out.add(cn)
+        nv = cert.get("name_value") or ""
+        if nv:
+            key = hash(nv)
+            if key in seen:
+                continue
+            seen.add(key)
+            for part in nv.lower().split():
+                if part.startswith("*."):
+                    part = part[2:]
+                if not suffix or part.endswith(suffix) or part == suffix_filter:
+                    out.add(part)
+
+    out.discard("")  # a bare "*." wildcard
+    return out
@@ -8,147 +8,524 @@ By default it prints the full hostnames. Add **--trim** to strip the base
 Examples
 --------
 # All names for cmslegal.com
-$ python crtsh_subextractor.py cmslegal.com
+$ python crtshadow.py cmslegal.com
 
 # Only cmslegal.com and its sub‑domains
-$ python crtsh_subextractor.py cmslegal.com --same
+$ python crtshadow.py cmslegal.com --same
 
 # List host parts only (events, api-test.ci, …)
-$ python crtsh_subextractor.py cmslegal.com --trim
+$ python crtshadow.py cmslegal.com --trim
+
+# Several targets in one run, tagged "<domain><TAB><hostname>"
+$ python crtshadow.py cmslegal.com example.com -l more.txt
 """
 from __future__ import annotations
 
 import argparse
-from typing import Iterable, List, Set
-
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import asyncio
+import gzip
+import hashlib
+import importlib.util
+import io
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import (IO, AsyncIterator, Iterable, Iterator, List, Optional,
+                    Sequence, Set, Union)
+
+import aiohttp
+from aiohttp_retry import ExponentialRetry, RetryClient
 from tqdm import tqdm
 
+try:
+    import ijson
+except ImportError:  # pragma: no cover - streaming is optional
+    ijson = None
 
-# ---------------------------------------------------------------------------
-# Network helpers
-# ---------------------------------------------------------------------------
-
-def _session() -> requests.Session:
-    s = requests.Session()
-    retry = Retry(
-        total=5,
-        backoff_factor=1,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods={"GET"},
-    )
-    s.mount("https://", HTTPAdapter(max_retries=retry))
-    s.mount("http://", HTTPAdapter(max_retries=retry))
-    return s
+try:
+    from orjson import loads as _loads
+except ImportError:  # pragma: no cover - orjson is optional
+    from json import loads as _loads
 
+_CHUNK = 64 * 1024
 
-def fetch(domain: str, https: bool = True, verbose: bool = False) -> List[dict]:
-    """Return raw JSON from crt.sh. Falls back to HTTP on 503."""
-    proto = "https" if https else "http"
-    url = f"{proto}://crt.sh/?q=%25.{domain}&output=json"
+# An empty XDG_CACHE_HOME counts as unset, per the XDG base directory spec
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME") or "~/.cache").expanduser() \
+    / "crtshadow"
+CACHE_TTL = 3600.0  # seconds
+CONCURRENCY = 8
 
-    header = {
-        "User-Agent": (
-            "Mozilla/5.0 (X11; Linux x86_64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/114.0.5735.198 Safari/537.36"
-        )
-    }
 
+def _log(msg: str, verbose: bool) -> None:
+    # tqdm.write clears and redraws any live progress bar around the message
     if verbose:
-        print(f"Fetching {url}")
-    sess = _session()
-    resp = sess.get(url, headers=header, timeout=10)
+        tqdm.write(msg)
+
 
-    # crt.sh sometimes blocks HTTPS; try HTTP once
-    if resp.status_code == 503 and https:
-        if verbose:
-            print("HTTPS gave 503, retrying over HTTP …")
-        return fetch(domain, https=False, verbose=verbose)
+# ---------------------------------------------------------------------------
+# Decoding and cache helpers
+# ---------------------------------------------------------------------------
 
-    resp.raise_for_status()
-    return resp.json()
+class _EntryParser:
+    """Incrementally decode a crt.sh JSON array, one chunk at a time.
+
+    Without ijson the chunks are buffered and decoded in :meth:`close`.
+    """
+
+    def __init__(self) -> None:
+        if ijson is None:
+            self._buf = bytearray()
+        else:
+            self._entries = ijson.sendable_list()
+            self._coro = ijson.items_coro(self._entries, "item")
+
+    def feed(self, chunk: bytes) -> List[dict]:
+        """Consume *chunk* and return the entries completed by it."""
+        if ijson is None:
+            self._buf += chunk
+            return []
+        self._coro.send(chunk)
+        batch = self._entries[:]
+        del self._entries[:]
+        return batch
+
+    def close(self) -> List[dict]:
+        """Finish decoding and return whatever entries are left."""
+        if ijson is None:
+            return _loads(bytes(self._buf))
+        self._coro.close()
+        return self._entries[:]
+
+
+def _cache_path(domain: str) -> Path:
+    key = hashlib.sha256(domain.encode()).hexdigest()[:16]
+    return CACHE_DIR / f"{key}.json.gz"
+
+
+def _is_fresh(path: Path, ttl: float) -> bool:
+    try:
+        return time.time() - path.stat().st_mtime < ttl
+    except FileNotFoundError:
+        return False
+
+
+def _read_cache(path: Path) -> Iterator[List[dict]]:
+    """Yield cached entries in batches, like :func:`fetch_async` does."""
+    parser = _EntryParser()
+    with gzip.open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b""):
+            batch = parser.feed(chunk)
+            if batch:
+                yield batch
+    batch = parser.close()
+    if batch:
+        yield batch
+
+
+class _CacheSink:
+    """Best-effort gzip copy of a response body, stored at *path*.
+
+    The body goes to a private temporary file that replaces *path* only
+    once the download completes. Any cache I/O error is logged and turns
+    the sink into a no-op, so a broken cache never fails the query.
+    """
+
+    def __init__(self, path: Optional[Path], verbose: bool = False) -> None:
+        self._path = path
+        self._verbose = verbose
+        self._raw: Optional[IO[bytes]] = None
+        self._gz: Optional[gzip.GzipFile] = None
+        if path is None:
+            return
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._raw = tempfile.NamedTemporaryFile(
+                dir=path.parent, prefix=path.name + ".", suffix=".part",
+                delete=False,
+            )
+            self._gz = gzip.GzipFile(fileobj=self._raw, mode="wb",
+                                     compresslevel=1)
+        except OSError as exc:
+            self._fail(exc)
+
+    def write(self, chunk: bytes) -> None:
+        if self._gz is None:
+            return
+        try:
+            self._gz.write(chunk)
+        except OSError as exc:
+            self._fail(exc)
+
+    def __enter__(self) -> "_CacheSink":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self._gz is None:
+            return
+        if exc_type is not None:
+            self._discard()
+            return
+        try:
+            self._gz.close()
+            self._raw.close()
+            os.replace(self._raw.name, self._path)
+        except OSError as exc:
+            self._fail(exc)
+        self._gz = self._raw = None
+
+    def _fail(self, exc: OSError) -> None:
+        _log(f"Not caching response: {exc}", self._verbose)
+        self._discard()
+
+    def _discard(self) -> None:
+        for f in (self._gz, self._raw):
+            if f is not None:
+                try:
+                    f.close()
+                except OSError:
+                    pass
+        if self._raw is not None:
+            try:
+                os.unlink(self._raw.name)
+            except OSError:
+                pass
+        self._gz = self._raw = None
 
 
 # ---------------------------------------------------------------------------
-# Parsing helpers
+# Network helpers
 # ---------------------------------------------------------------------------
 
-def _clean(hosts: Iterable[str]) -> Set[str]:
-    out: Set[str] = set()
-    for h in hosts:
-        h = h.strip()
-        if h.startswith("*."):
-            h = h[2:]
-        if h:
-            out.add(h.lower())
-    return out
+class _RetryAfter(ExponentialRetry):
+    """Exponential backoff that defers to a server-sent Retry-After.
+
+    The server's delay is still capped at ``max_timeout``.
+    """
+
+    def get_timeout(self, attempt: int,
+                    response: Optional[aiohttp.ClientResponse] = None) -> float:
+        if response is not None:
+            after = response.headers.get("Retry-After", "")
+            if after.isdigit():
+                return min(float(after), self._max_timeout)
+        return super().get_timeout(attempt, response)
+
+
+def _accept_encoding() -> str:
+    """Offer Brotli only when aiohttp has a decoder for it."""
+    for mod in ("brotli", "brotlicffi"):
+        if importlib.util.find_spec(mod) is not None:
+            return "gzip, deflate, br"
+    return "gzip, deflate"
+
+
+# Immutable request configuration, built once at import time
+_RETRY = _RetryAfter(
+    attempts=5,
+    start_timeout=1,
+    statuses=frozenset({429, 500, 502, 503, 504}),
+    methods=frozenset({"GET"}),
+    # crt.sh often resets or stalls connections; retry those like urllib3 did
+    exceptions=frozenset({aiohttp.ClientConnectionError, asyncio.TimeoutError}),
+)
+_TIMEOUT = aiohttp.ClientTimeout(sock_connect=10, sock_read=10)
+_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (X11; Linux x86_64) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/114.0.5735.198 Safari/537.36"
+    ),
+    "Accept": "application/json",
+    "Accept-Encoding": _accept_encoding(),
+    "Connection": "keep-alive",
+}
+
+
+def _session() -> RetryClient:
+    """Build the one client shared by every request of a run.
+
+    Keep-alive connections are pooled per host, so the HTTP fallback and
+    any further queries reuse sockets instead of opening new ones.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=32,
+        limit_per_host=16,
+        ttl_dns_cache=300,
+        keepalive_timeout=30,
+    )
+    return RetryClient(
+        client_session=aiohttp.ClientSession(connector=connector),
+        retry_options=_RETRY,
+    )
 
 
-def extract(entries: List[dict], verbose: bool = False) -> Set[str]:
+async def fetch_async(
+    domain: str,
+    session: RetryClient,
+    verbose: bool = False,
+    cache_ttl: float = CACHE_TTL,
+) -> AsyncIterator[List[dict]]:
+    """Yield raw crt.sh JSON entries in batches as the body streams in.
+
+    Falls back to HTTP on 503. Without ijson the whole body is decoded at
+    once and yielded as a single batch. Responses are cached on disk for
+    *cache_ttl* seconds; pass 0 to bypass the cache.
+    """
+    cache = _cache_path(domain) if cache_ttl > 0 else None
+    if cache is not None and _is_fresh(cache, cache_ttl):
+        _log(f"Using cached response {cache}", verbose)
+        for batch in _read_cache(cache):
+            yield batch
+        return
+
+    for proto in ("https", "http"):
+        url = f"{proto}://crt.sh/?q=%25.{domain}&output=json"
+        _log(f"Fetching {url}", verbose)
+        async with session.get(url, headers=_HEADERS,
+                               timeout=_TIMEOUT) as resp:
+            # crt.sh sometimes blocks HTTPS; try HTTP once
+            if resp.status == 503 and proto == "https":
+                _log("HTTPS gave 503, retrying over HTTP …", verbose)
+                continue
+
+            resp.raise_for_status()
+            parser = _EntryParser()
+            with _CacheSink(cache, verbose) as sink:
+                async for chunk in resp.content.iter_chunked(_CHUNK):
+                    sink.write(chunk)
+                    batch = parser.feed(chunk)
+                    if batch:
+                        yield batch
+                batch = parser.close()
+                if batch:
+                    yield batch
+            return
+
+
+async def harvest(domain: str, session: RetryClient, verbose: bool = False,
+                  same: bool = False, cache_ttl: float = CACHE_TTL,
+                  bar: Optional[tqdm] = None) -> Set[str]:
+    """Extract hostnames for *domain* while its response is still arriving.
+
+    Progress goes to *bar* when given (shared by a batch of domains),
+    otherwise to a bar of its own while *verbose*.
+    """
     names: Set[str] = set()
+    seen: Set[int] = set()
+    suffix_filter = domain if same else None
+    received = 0
+    own = bar is None
+    if own:
+        bar = tqdm(desc=domain, disable=not verbose, mininterval=0.5)
+    try:
+        async for batch in fetch_async(domain, session, verbose=verbose,
+                                       cache_ttl=cache_ttl):
+            names |= extract(batch, suffix_filter=suffix_filter, seen=seen)
+            received += len(batch)
+            bar.update(len(batch))
+    finally:
+        if own:
+            bar.close()
+    _log(f"Received {received} cert entries for {domain}", verbose)
+    return names
+
+
+async def gather_domains(domains: Sequence[str], verbose: bool = False,
+                         same: bool = False, cache_ttl: float = CACHE_TTL,
+                         concurrency: int = CONCURRENCY,
+                         ) -> List[Union[Set[str], Exception]]:
+    """Harvest every domain over one pooled session.
+
+    At most *concurrency* crt.sh queries are in flight at once. A domain
+    that fails yields its exception in place of a result, so the other
+    domains still finish.
+    """
+    gate = asyncio.Semaphore(max(1, concurrency))
+    # One bar for the whole batch; concurrent per-domain bars would fight
+    # over the same terminal line.
+    bar = tqdm(desc="certificates", disable=not verbose, mininterval=0.5)
+
+    async def one(domain: str, session: RetryClient) -> Set[str]:
+        async with gate:
+            return await harvest(domain, session, verbose=verbose, same=same,
+                                 cache_ttl=cache_ttl, bar=bar)
+
+    with bar:
+        async with _session() as session:
+            results = await asyncio.gather(
+                *[one(d, session) for d in domains], return_exceptions=True
+            )
+    for r in results:
+        if isinstance(r, BaseException) and not isinstance(r, Exception):
+            raise r  # cancellation and the like are not per-domain errors
+    return results
 
-    loop = tqdm(entries, desc="certificates") if verbose else entries
-    for cert in loop:
-        cn = cert.get("common_name", "")
+
+# ---------------------------------------------------------------------------
+# Parsing helpers
+# ---------------------------------------------------------------------------
+
+def extract(entries: Iterable[dict], suffix_filter: Optional[str] = None,
+            seen: Optional[Set[int]] = None) -> Set[str]:
+    """Normalise every hostname straight into the result set.
+
+    With *suffix_filter* set, only that domain and its sub-domains are kept.
+    *seen* collects hashes of the ``name_value`` strings already expanded
+    (a fixed-size key, not the string); pass the same set across calls to
+    skip them in later batches too.
+    """
+    out: Set[str] = set()
+    add = out.add
+    # Plain str.endswith beat both a slice compare and one regex over the
+    # joined names; test it before the rarer exact match on the apex.
+    suffix = "." + suffix_filter if suffix_filter else ""
+    if seen is None:
+        seen = set()
+
+    for cert in entries:
+        cn = (cert.get("common_name") or "").strip().lower()
         if cn:
-            names.add(cn)
-        for part in cert.get("name_value", "").split():
-            if part:
-                names.add(part)
+            cn = cn.removeprefix("*.")
+            if not suffix or cn.endswith(suffix) or cn == suffix_filter:
+                add(cn)
+        # Precerts, final certs and renewals repeat the exact same SAN list;
+        # one lookup skips re-normalising every name in it.
+        nv = cert.get("name_value", "")
+        if nv:
+            key = hash(nv)
+            if key in seen:
+                continue
+            seen.add(key)
+            # str.lower already takes an ASCII fast path; a bytes round trip
+            # (encode, bytes.lower, decode per name) measured ~2x slower.
+            for part in nv.lower().split():
+                part = part.removeprefix("*.")
+                if not suffix or part.endswith(suffix) or part == suffix_filter:
+                    add(part)
+
+    out.discard("")  # a bare "*." wildcard
+    return out
 
-    return _clean(names)
+
+try:  # compiled from _extract.pyx with `cythonize -i _extract.pyx`
+    from _extract import extract  # noqa: F811
+except ImportError:  # pragma: no cover - pure-Python version above
+    pass
 
 
 # ---------------------------------------------------------------------------
 # Main
 # ---------------------------------------------------------------------------
 
+def _open_out(path: str) -> IO[str]:
+    """Open *path* for text output, compressing by its .gz/.zst extension."""
+    if path.endswith(".zst"):
+        import zstandard as zstd  # optional, only needed for .zst output
+        raw = open(path, "wb")
+        writer = zstd.ZstdCompressor(level=3).stream_writer(raw)
+        return io.TextIOWrapper(writer, encoding="utf-8")
+    if path.endswith(".gz"):
+        return gzip.open(path, "wt", compresslevel=3, encoding="utf-8")
+    return open(path, "w", encoding="utf-8")
+
+
+def _read_domains(path: str) -> List[str]:
+    """One domain per line; blank lines and # comments are skipped."""
+    with open(path, encoding="utf-8") as f:
+        lines = (ln.strip() for ln in f)
+        return [ln for ln in lines if ln and not ln.startswith("#")]
+
+
 def main() -> None:  # pragma: no cover
     p = argparse.ArgumentParser(description="Extract hostnames from crt.sh")
-    p.add_argument("domain", help="base domain, e.g. example.com")
+    p.add_argument("domains", nargs="*", metavar="domain",
+                   help="base domain, e.g. example.com")
+    p.add_argument("-l", "--list", metavar="FILE",
+                   help="read further domains from FILE, one per line")
     p.add_argument("-s", "--same", action="store_true",
                    help="only keep <domain> and its sub‑domains")
     p.add_argument("-t", "--trim", action="store_true",
                    help="strip the base suffix (output host part only)")
-    p.add_argument("-o", "--output", metavar="FILE",
-                   help="write to FILE instead of stdout")
+    dest = p.add_mutually_exclusive_group()
+    dest.add_argument("-o", "--output", metavar="FILE",
+                      help="write to FILE instead of stdout "
+                           "(.gz/.zst names are compressed)")
+    dest.add_argument("-d", "--output-dir", metavar="DIR",
+                      help="write one <domain>.txt per domain into DIR")
+    p.add_argument("-c", "--concurrency", type=int, default=CONCURRENCY,
+                   metavar="N",
+                   help=f"parallel crt.sh queries (default {CONCURRENCY})")
+    p.add_argument("--no-sort", action="store_true",
+                   help="skip sorting, e.g. when piping into sort/uniq")
+    p.add_argument("--no-cache", action="store_true",
+                   help="always query crt.sh, ignoring the local cache")
+    p.add_argument("--cache-ttl", type=float, default=CACHE_TTL,
+                   metavar="SECONDS",
+                   help="reuse cached responses younger than this "
+                        f"(default {CACHE_TTL:.0f})")
     p.add_argument("-v", "--verbose", action="store_true")
 
     args = p.parse_args()
-    domain = args.domain.lower().strip()
-
-    data = fetch(domain, verbose=args.verbose)
-    if args.verbose:
-        print(f"Received {len(data)} cert entries")
-
-    names = extract(data, verbose=args.verbose)
-
-    if args.same:
-        suffix = "." + domain
-        names = {n for n in names if n == domain or n.endswith(suffix)}
-
-    if args.trim:
-        stripped: Set[str] = set()
-        suffix = "." + domain
-        for n in names:
-            if n == domain:
-                continue  # would be empty after stripping
-            if n.endswith(suffix):
-                n = n[: -len(suffix)]
-            stripped.add(n)
-        names = stripped
-
-    out = sorted(names)
-
-    if args.output:
-        with open(args.output, "w", encoding="utf-8") as f:
-            f.write("\n".join(out) + "\n")
-        print(f"Wrote {len(out)} lines to {args.output}")
-    else:
-        print("\n".join(out))
+    raw = list(args.domains)
+    if args.list:
+        raw += _read_domains(args.list)
+    cleaned = (d.lower().strip() for d in raw)
+    domains = list(dict.fromkeys(d for d in cleaned if d))
+    if not domains:
+        p.error("no domain given")
+    separators = {"/", os.sep, os.altsep} - {None}
+    for d in domains:
+        if any(sep in d for sep in separators):
+            p.error(f"invalid domain: {d!r}")
+    if (args.output and args.output.endswith(".zst")
+            and importlib.util.find_spec("zstandard") is None):
+        p.error(".zst output needs the zstandard package "
+                "(pip3 install zstandard)")
+
+    cache_ttl = 0 if args.no_cache else args.cache_ttl
+    results = asyncio.run(
+        gather_domains(domains, verbose=args.verbose, same=args.same,
+                       cache_ttl=cache_ttl, concurrency=args.concurrency)
+    )
+
+    per_domain = {}
+    failed = 0
+    for domain, names in zip(domains, results):
+        if isinstance(names, Exception):
+            print(f"{domain}: {type(names).__name__}: {names}", file=sys.stderr)
+            failed += 1
+            continue
+        if args.trim:
+            suffix = "." + domain
+            # <domain> itself would be empty after stripping
+            names = {n.removesuffix(suffix) for n in names if n != domain}
+        per_domain[domain] = names if args.no_sort else sorted(names)
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        for domain, names in per_domain.items():
+            path = os.path.join(args.output_dir, f"{domain}.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("\n".join(names) + "\n")
+            print(f"Wrote {len(names)} lines to {path}")
+    elif per_domain:
+        if len(domains) == 1:
+            out = per_domain[domains[0]]
+        else:
+            out = [f"{d}\t{n}" for d, names in per_domain.items()
+                   for n in names]
+
+        if args.output:
+            with _open_out(args.output) as f:
+                f.write("\n".join(out) + "\n")
+            print(f"Wrote {len(out)} lines to {args.output}")
+        else:
+            sys.stdout.write("\n".join(out) + "\n")
+
+    if failed:
+        sys.exit(f"{failed} of {len(domains)} domain(s) failed")
 
 
 if __name__ == "__main__":